@@ -4,6 +4,13 @@ Created on 29 Oct 2012
 @author: Dave Wilson
 '''
 
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 import ymvc
 
@@ -223,6 +230,242 @@ class TestController(unittest.TestCase):
         self.assertEqual(value, note_value)
 
 
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = ymvc.Tracer()
+        self.observer = ymvc.Observer("app", self.tracer)
+        self.controller = ymvc.Controller(self.observer)
+        self.event_handler = ymvc.EventHandler(self.observer)
+        self.temp_dir = tempfile.mkdtemp()
+        self.default_timer = ymvc.default_timer
+
+    def tearDown(self):
+        ymvc.default_timer = self.default_timer
+        shutil.rmtree(self.temp_dir)
+
+    def use_counter_timer(self):
+        '''Each call to the timer advances it by one second'''
+        counter = itertools.count()
+        ymvc.default_timer = lambda: float(next(counter))
+
+    def create_command(self):
+        observer = self.observer
+
+        class Command(object):
+
+            def handle_note(self, note):
+                observer.notify("event2", "data")
+
+        return Command
+
+    def trace_cascade(self):
+        self.controller.bind("event1", self.create_command())
+        self.event_handler.bind("event2", lambda note: None)
+        self.tracer.start()
+        self.observer.notify("event1", "data")
+        self.tracer.stop()
+
+    def test_disabled_records_nothing(self):
+        self.controller.bind("event1", self.create_command())
+        self.observer.notify("event1", "data")
+        self.assertEqual([], self.tracer.events)
+        self.assertEqual({}, self.tracer.collapsed)
+
+    def test_span_names(self):
+        self.trace_cascade()
+        names = [event["name"] for event in self.tracer.events]
+        self.assertEqual(["instantiate Command", "<lambda>",
+                          "notify event2", "execute Command",
+                          "notify event1"], names)
+
+    def test_span_nesting(self):
+        self.trace_cascade()
+        events = dict((event["name"], event) for event in self.tracer.events)
+        outer = events["notify event1"]
+        inner = events["notify event2"]
+        self.assertEqual("app", outer["cat"])
+        self.assertEqual("controller", events["execute Command"]["cat"])
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"],
+                                inner["ts"] + inner["dur"])
+
+    def test_collapsed_stacks(self):
+        self.trace_cascade()
+        value = ["notify event1",
+                 "notify event1;execute Command",
+                 "notify event1;execute Command;notify event2",
+                 "notify event1;execute Command;notify event2;<lambda>",
+                 "notify event1;instantiate Command"]
+        self.assertEqual(value, sorted(self.tracer.collapsed))
+
+    def test_gui_event_name(self):
+        self.tracer.start()
+        self.observer.register(("clicked", 1), lambda note: None, "uid")
+        self.observer.notify(("clicked", 1))
+        self.assertEqual("notify clicked", self.tracer.events[0]["name"])
+
+    def test_write_chrome_trace(self):
+        self.trace_cascade()
+        path = os.path.join(self.temp_dir, "trace.json")
+        self.tracer.write_chrome_trace(path)
+        with open(path) as trace_file:
+            trace = json.load(trace_file)
+        self.assertEqual(5, len(trace["traceEvents"]))
+        self.assertEqual("X", trace["traceEvents"][0]["ph"])
+
+    def test_write_collapsed(self):
+        self.trace_cascade()
+        path = os.path.join(self.temp_dir, "trace.folded")
+        self.tracer.write_collapsed(path)
+        with open(path) as collapsed_file:
+            lines = collapsed_file.read().splitlines()
+        self.assertEqual(5, len(lines))
+        stack, weight = lines[0].rsplit(" ", 1)
+        self.assertEqual("notify event1", stack)
+        self.assertTrue(weight.isdigit())
+
+    def test_self_time(self):
+        self.use_counter_timer()
+        self.tracer.start()
+        with self.tracer.span("a", "cat"):
+            with self.tracer.span("b", "cat"):
+                pass
+        events = dict((event["name"], event) for event in self.tracer.events)
+        self.assertEqual(1e6, events["b"]["dur"])
+        self.assertEqual(3e6, events["a"]["dur"])
+        self.assertEqual({"a": 2e6, "a;b": 1e6}, self.tracer.collapsed)
+
+    def test_self_time_is_duration_minus_children(self):
+        self.use_counter_timer()
+        self.trace_cascade()
+        events = self.tracer.events
+        self.assertEqual(sum(event["dur"] for event in events
+                             if event["name"] == "notify event1"),
+                         sum(self.tracer.collapsed.values()))
+        execute = [event for event in events
+                   if event["name"] == "execute Command"][0]
+        notify = [event for event in events
+                  if event["name"] == "notify event2"][0]
+        self.assertEqual(execute["dur"] - notify["dur"],
+                         self.tracer.collapsed[
+                             "notify event1;execute Command"])
+
+    def test_bound_method_label(self):
+
+        class Owner(object):
+
+            def method(self, note):
+                pass
+
+        self.event_handler.bind("event1", Owner().method)
+        self.tracer.start()
+        self.observer.notify("event1")
+        self.assertEqual("Owner.method", self.tracer.events[0]["name"])
+
+    def test_handler_raises(self):
+
+        def handler(note):
+            raise ValueError("handler")
+
+        self.event_handler.bind("event1", handler)
+        self.tracer.start()
+        self.assertRaises(ValueError, self.observer.notify, "event1")
+        names = [event["name"] for event in self.tracer.events]
+        self.assertEqual(["handler", "notify event1"], names)
+        self.assertEqual([], self.tracer.current_stack())
+
+    def test_restart_while_span_open(self):
+        tracer = self.tracer
+        self.event_handler.bind("event1", lambda note: tracer.start())
+        tracer.start()
+        self.observer.notify("event1")
+        self.assertTrue(tracer.enabled)
+        self.assertEqual([], tracer.events)
+        self.assertEqual([], tracer.current_stack())
+        self.observer.notify("event1")
+        self.assertEqual([], tracer.events)
+
+    def test_stop_while_span_open(self):
+        tracer = self.tracer
+        self.event_handler.bind("event1", lambda note: tracer.stop())
+        tracer.start()
+        self.observer.notify("event1")
+        self.assertFalse(tracer.enabled)
+        self.assertEqual(2, len(tracer.events))
+        self.assertEqual([], tracer.current_stack())
+
+    def test_threads_keep_separate_stacks(self):
+        opened = threading.Event()
+        closed = threading.Event()
+
+        def run():
+            with self.tracer.span("a", "cat"):
+                opened.set()
+                closed.wait()
+
+        self.tracer.start()
+        thread = threading.Thread(target=run)
+        thread.start()
+        opened.wait()
+        with self.tracer.span("b", "cat"):
+            pass
+        closed.set()
+        thread.join()
+        self.assertEqual(["a", "b"], sorted(self.tracer.collapsed))
+        tids = dict((event["name"], event["tid"])
+                    for event in self.tracer.events)
+        self.assertNotEqual(tids["a"], tids["b"])
+
+    def test_observer_without_tracer(self):
+
+        class DuckObserver(object):
+
+            def register(self, event_name, func, uid):
+                pass
+
+        notes = []
+
+        class Command(object):
+
+            def handle_note(self, note):
+                notes.append(note)
+
+        note = {"event_name": "event1"}
+        event_handler = ymvc.EventHandler(DuckObserver())
+        event_handler.bind("event1", notes.append)
+        event_handler.handle_note(note)
+        controller = ymvc.Controller(DuckObserver())
+        controller.bind("event1", Command)
+        controller.handle_note(note)
+        self.assertEqual([note, note], notes)
+
+    def test_non_ascii_event_name(self):
+        self.event_handler.bind(u"caf\xe9", lambda note: None)
+        self.tracer.start()
+        self.observer.notify(u"caf\xe9")
+        self.observer.register(b"caf\xc3\xa9", lambda note: None, "uid")
+        self.observer.notify(b"caf\xc3\xa9")
+        trace_path = os.path.join(self.temp_dir, "trace.json")
+        collapsed_path = os.path.join(self.temp_dir, "trace.folded")
+        self.tracer.write_chrome_trace(trace_path)
+        self.tracer.write_collapsed(collapsed_path)
+        with io.open(trace_path, encoding="utf-8") as trace_file:
+            trace = json.load(trace_file)
+        names = [event["name"] for event in trace["traceEvents"]]
+        self.assertEqual([u"<lambda>", u"notify caf\xe9", u"notify caf\xe9"],
+                         names)
+        with io.open(collapsed_path, encoding="utf-8") as collapsed_file:
+            lines = collapsed_file.read().splitlines()
+        self.assertEqual(u"notify caf\xe9", lines[0].rsplit(u" ", 1)[0])
+
+    def test_start_clears_recording(self):
+        self.trace_cascade()
+        self.tracer.start()
+        self.assertEqual([], self.tracer.events)
+        self.assertEqual({}, self.tracer.collapsed)
+
+
 class TestFacade(unittest.TestCase):
 
     def setUp(self):
@@ -257,6 +500,12 @@ class TestFacade(unittest.TestCase):
         self.assertEqual(self.facade.app_observer,
                          self.facade.controller.observer)
 
+    def test_tracer(self):
+        self.assertIsInstance(self.facade.tracer, ymvc.Tracer)
+        self.assertEqual(self.facade.tracer, self.facade.model_observer.tracer)
+        self.assertEqual(self.facade.tracer, self.facade.app_observer.tracer)
+        self.assertEqual(self.facade.tracer, self.facade.gui_observer.tracer)
+
     def test_gui_observer(self):
         self.assertIsInstance(self.facade.gui_observer, ymvc.Observer)
         self.assertNotEqual(self.facade.model_observer,
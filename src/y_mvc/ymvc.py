@@ -4,14 +4,156 @@ Created on 25 Oct 2012
 @author: Dave Wilson
 '''
 
+from contextlib import contextmanager
+from timeit import default_timer
 from uuid import uuid4
+import io
+import json
+import os
+import threading
+
+
+def event_label(event_name):
+    '''Printable name of a event_name, gui event_names are (name, view_id)'''
+    if isinstance(event_name, tuple):
+        event_name = event_name[0]
+    if isinstance(event_name, bytes):
+        return event_name.decode("utf-8", "replace")
+    return u"%s" % (event_name,)
+
+
+def handler_label(handler):
+    '''Printable name of a handler function, method or Command class'''
+    name = getattr(handler, "__name__", None) or handler.__class__.__name__
+    owner = getattr(handler, "__self__", None)
+    if owner is not None:
+        return u"%s.%s" % (owner.__class__.__name__, name)
+    return u"%s" % name
+
+
+class NullSpan(object):
+    '''Context that does nothing, used in place of a span when not tracing'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_span = NullSpan()
+
+
+def trace_span(tracer, cat, template, label, item):
+    '''A span named template % label(item) if tracer is recording, else
+    null_span, the label is only built while recording'''
+    if tracer is None or not tracer.enabled:
+        return null_span
+    return tracer.span(template % label(item), cat)
+
+
+class Span(object):
+    '''An open span on a thread's stack of the recording generation'''
+    def __init__(self, name, begin, generation, stack):
+        self.name = name
+        self.begin = begin
+        self.child_time = 0.0
+        self.generation = generation
+        self.stack = stack
+
+
+class Tracer(object):
+    '''Records timed spans of nested dispatch so a notification cascade
+    can be viewed as a chrome trace or a flamegraph, each thread keeps
+    its own stack of open spans'''
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.collapsed = {}
+        self.generation = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.start_time = default_timer()
+
+    def start(self):
+        '''Clear any previous recording and start tracing, spans still
+        open from a previous recording are dropped when they close'''
+        with self.lock:
+            self.events = []
+            self.collapsed = {}
+            self.generation += 1
+            self.start_time = default_timer()
+            self.enabled = True
+
+    def stop(self):
+        '''Stop tracing, the recording is kept until the next start'''
+        self.enabled = False
+
+    def current_stack(self):
+        '''The calling thread's stack of open spans for this recording'''
+        local = self.local
+        if getattr(local, "generation", None) != self.generation:
+            local.generation = self.generation
+            local.stack = []
+        return local.stack
+
+    @contextmanager
+    def span(self, name, cat):
+        '''Time the enclosed block as a span nested in any open span'''
+        stack = self.current_stack()
+        span = Span(name, default_timer(), self.generation, stack)
+        stack.append(span)
+        try:
+            yield
+        finally:
+            self.end_span(span, cat)
+
+    def end_span(self, span, cat):
+        '''Close span and record it if it belongs to the current recording'''
+        end = default_timer()
+        stack = span.stack
+        if not stack or stack[-1] is not span:
+            return
+        duration = end - span.begin
+        stack_key = u";".join(item.name.replace(u";", u":")
+                              for item in stack)
+        stack.pop()
+        if stack:
+            stack[-1].child_time += duration
+        with self.lock:
+            if span.generation != self.generation:
+                return
+            self.events.append({"name": span.name, "cat": cat, "ph": "X",
+                                "ts": (span.begin - self.start_time) * 1e6,
+                                "dur": duration * 1e6,
+                                "pid": os.getpid(),
+                                "tid": threading.current_thread().ident})
+            self_time = (duration - span.child_time) * 1e6
+            self.collapsed[stack_key] = (
+                self.collapsed.get(stack_key, 0.0) + self_time)
+
+    def write_chrome_trace(self, path):
+        '''Write the spans as chrome trace-event json (chrome://tracing,
+        perfetto or speedscope)'''
+        trace = json.dumps({"traceEvents": self.events,
+                            "displayTimeUnit": "ms"})
+        with io.open(path, "w", encoding="utf-8") as trace_file:
+            trace_file.write(u"%s" % trace)
+
+    def write_collapsed(self, path):
+        '''Write the spans as collapsed stacks weighted by self time in
+        microseconds (flamegraph.pl or speedscope)'''
+        with io.open(path, "w", encoding="utf-8") as collapsed_file:
+            for stack_key in sorted(self.collapsed):
+                collapsed_file.write(u"%s %d\n" % (
+                    stack_key, round(self.collapsed[stack_key])))
 
 
 class Observer(object):
     '''Stores a dictionary of functions that will be notified if they
     have an interest in a event_name'''
-    def __init__(self):
+    def __init__(self, name="", tracer=None):
         self.observers = {}
+        self.name = name
+        self.tracer = tracer
 
     def register(self, event_name, func, uid):
         '''Register a function/uid pair's interest in a event_name'''
@@ -25,8 +167,10 @@ class Observer(object):
         note.update(kwargs)
         observer_dict = self.observers.get(event_name, False)
         if observer_dict:
-            for func in observer_dict.itervalues():
-                func(note)
+            with trace_span(self.tracer, self.name, u"notify %s",
+                            event_label, event_name):
+                for func in observer_dict.itervalues():
+                    func(note)
 
     def unregister(self, event_name, uid):
         '''unregister uid's interest in event_name'''
@@ -89,6 +233,8 @@ class EventHandler(object):
         self.uid = uuid4()
         self.events = UniqueDict()
         self.observer = observer
+        self.tracer = getattr(observer, "tracer", None)
+        self.trace_cat = getattr(observer, "name", "")
 
     def bind(self, event_name, handler):
         self.events[event_name] = handler
@@ -100,7 +246,10 @@ class EventHandler(object):
 
     def handle_note(self, note):
         event_name = note["event_name"]
-        self.events[event_name](note)
+        handler = self.events[event_name]
+        with trace_span(self.tracer, self.trace_cat, u"%s", handler_label,
+                        handler):
+            handler(note)
 
     def register_event(self, event_name):
         self.observer.register(event_name, self.handle_note, self.uid)
@@ -119,20 +268,26 @@ class Controller(EventHandler):
 
     def handle_note(self, note):
         event_name = note["event_name"]
-        command = self.events[event_name]()
-        command.handle_note(note)
+        command_class = self.events[event_name]
+        with trace_span(self.tracer, "controller", u"instantiate %s",
+                        handler_label, command_class):
+            command = command_class()
+        with trace_span(self.tracer, "controller", u"execute %s",
+                        handler_label, command_class):
+            command.handle_note(note)
 
 
 class Facade(object):
     ''''''
     def __init__(self):
         ''''''
+        self.tracer = Tracer()
         self.model = ObjectStore()
-        self.model_observer = Observer()
+        self.model_observer = Observer("model", self.tracer)
         self.view = ObjectStore()
-        self.app_observer = Observer()
+        self.app_observer = Observer("app", self.tracer)
         self.controller = Controller(self.app_observer)
-        self.gui_observer = Observer()
+        self.gui_observer = Observer("gui", self.tracer)
 
 facade = Facade()
 